@@ -0,0 +1,116 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements. See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership. The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License. You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import asyncio
+import struct
+from io import BytesIO
+
+from thrift.transport.TTransport import TTransportBase, TTransportException
+
+__all__ = ['TAsyncioStreamTransport']
+
+I32 = struct.Struct("!i")
+
+
+class TAsyncioStreamTransport(TTransportBase):
+    """A framed, buffered transport over asyncio streams.
+
+    Writes are buffered like with any other transport; ``await flush()``
+    sends them as a single frame.  Like the Tornado transport, reads happen
+    a frame at a time: ``await readFrame()`` returns the next payload, which
+    can then be decoded from a TMemoryBuffer.  Only one coroutine may wait
+    on readFrame() at a time.
+    """
+
+    def __init__(self, host=None, port=None, reader=None, writer=None):
+        self.host = host
+        self.port = port
+        # servers provide ready-to-go streams
+        self._reader = reader
+        self._writer = writer
+        # the first four bytes are a placeholder for the frame size
+        self.__wbuf = BytesIO()
+        self.__wbuf.write(b'\x00\x00\x00\x00')
+
+    def isOpen(self):
+        return self._writer is not None and not self._writer.transport.is_closing()
+
+    async def open(self):
+        try:
+            self._reader, self._writer = await asyncio.open_connection(
+                self.host, self.port)
+        except OSError as e:
+            message = 'could not connect to {}:{} ({})'.format(self.host, self.port, e)
+            raise TTransportException(
+                type=TTransportException.NOT_OPEN,
+                message=message,
+                inner=e)
+        return self
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._reader = None
+
+    def read(self, sz):
+        # the protocols can't await, decode each frame from a TMemoryBuffer
+        raise TTransportException(
+            type=TTransportException.UNKNOWN,
+            message='TAsyncioStreamTransport only reads whole frames, use readFrame()')
+
+    async def readFrame(self):
+        try:
+            frame_header = await self._reader.readexactly(4)
+            frame_length, = I32.unpack(frame_header)
+            if frame_length < 0:
+                raise TTransportException(
+                    type=TTransportException.NEGATIVE_SIZE,
+                    message='Negative frame size (%d)' % frame_length)
+            return await self._reader.readexactly(frame_length)
+        except asyncio.IncompleteReadError as e:
+            raise TTransportException(
+                type=TTransportException.END_OF_FILE,
+                message='TAsyncioStreamTransport read %d bytes, expected %d'
+                        % (len(e.partial), e.expected),
+                inner=e)
+        except OSError as e:
+            raise TTransportException(
+                type=TTransportException.END_OF_FILE,
+                message=str(e),
+                inner=e)
+
+    def write(self, buf):
+        self.__wbuf.write(buf)
+
+    async def flush(self):
+        with self.__wbuf.getbuffer() as view:
+            I32.pack_into(view, 0, len(view) - 4)
+        frame = self.__wbuf.getvalue()
+        # reset wbuf before write/flush to preserve state on underlying failure
+        self.__wbuf.seek(4)
+        self.__wbuf.truncate()
+        try:
+            self._writer.write(frame)
+            await self._writer.drain()
+        except OSError as e:
+            raise TTransportException(
+                type=TTransportException.END_OF_FILE,
+                message=str(e),
+                inner=e)
@@ -17,10 +17,14 @@
 # under the License.
 #
 from io import BytesIO
-from struct import pack, unpack
+from struct import Struct
 
 from thrift.Thrift import TException
 
+_I32 = Struct("!i")
+_SASL_HDR = Struct(">BI")
+
+
 class TTransportException(TException):
     """Custom Transport Exception class"""
 
@@ -55,18 +59,30 @@ class TTransportBase(object):
         pass
 
     def readAll(self, sz):
-        buff = b''
-        have = 0
+        if sz <= 0:
+            # don't touch the transport at all, read(0) may trigger a refill
+            return b''
+        chunk = self.read(sz)
+        have = len(chunk)
+        if have == sz:
+            # common case: the whole request was satisfied by a single read
+            return chunk
+        if have == 0:
+            raise EOFError()
+
+        # collect the chunks and join them once instead of growing a bytes
+        # object on every iteration, which is quadratic in the total size
+        parts = [chunk]
         while (have < sz):
             chunk = self.read(sz - have)
             chunkLen = len(chunk)
             have += chunkLen
-            buff += chunk
+            parts.append(chunk)
 
             if chunkLen == 0:
                 raise EOFError()
 
-        return buff
+        return b''.join(parts)
 
     def write(self, buf):
         pass
@@ -90,6 +106,17 @@ class CReadableTransport(object):
         """A cStringIO buffer that contains the current chunk we are reading."""
         pass
 
+    @property
+    def cbuf(self):
+        """A read-only memoryview of the unread part of cstringio_buf.
+
+        This doesn't consume anything from the buffer.  For read buffers
+        built from a bytes object the view shares that object's memory
+        instead of copying it.
+        """
+        buf = self.cstringio_buf
+        return memoryview(buf.getvalue())[buf.tell():]
+
     def cstringio_refill(self, partialread, reqlen):
         """Refills cstringio_buf.
 
@@ -145,6 +172,8 @@ class TBufferedTransport(TTransportBase, CReadableTransport):
         self.__wbuf = BytesIO()
         # Pass string argument to initialize read buffer as cStringIO.InputType
         self.__rbuf = BytesIO(b'')
+        # bound read of the current buffer, rebound whenever it is replaced
+        self.__rbuf_read = self.__rbuf.read
         self.__rbuf_size = rbuf_size
 
     def isOpen(self):
@@ -157,53 +186,69 @@ class TBufferedTransport(TTransportBase, CReadableTransport):
         return self.__trans.close()
 
     def read(self, sz):
-        ret = self.__rbuf.read(sz)
-        if len(ret) != 0:
+        ret = self.__rbuf_read(sz)
+        if ret:
             return ret
-        self.__rbuf = BytesIO(self.__trans.read(max(sz, self.__rbuf_size)))
-        return self.__rbuf.read(sz)
+        if sz >= self.__rbuf_size:
+            # nothing would be left over to buffer, so skip the BytesIO
+            return self.__trans.read(sz)
+        # BytesIO shares the bytes object it is created from, so this
+        # doesn't copy the data read from the underlying transport
+        self.__rbuf = BytesIO(self.__trans.read(self.__rbuf_size))
+        self.__rbuf_read = self.__rbuf.read
+        return self.__rbuf_read(sz)
 
     def write(self, buf):
         try:
             self.__wbuf.write(buf)
         except Exception as e:
             # on exception reset wbuf so it doesn't contain a partial function call
-            self.__wbuf = BytesIO()
+            self.__reset_wbuf()
             raise e
 
     def flush(self):
         out = self.__wbuf.getvalue()
         # reset wbuf before write/flush to preserve state on underlying failure
-        self.__wbuf = BytesIO()
+        self.__reset_wbuf()
         self.__trans.write(out)
         self.__trans.flush()
 
+    def __reset_wbuf(self):
+        # rewind rather than allocate a new BytesIO; truncating releases
+        # the memory the last message used, so nothing is retained
+        self.__wbuf.seek(0)
+        self.__wbuf.truncate(0)
+
     # Implement the CReadableTransport interface.
     @property
     def cstringio_buf(self):
         return self.__rbuf
 
     def cstringio_refill(self, partialread, reqlen):
-        retstring = partialread
+        parts = [partialread]
+        have = len(partialread)
         if reqlen < self.__rbuf_size:
             # try to make a read of as much as we can.
-            retstring += self.__trans.read(self.__rbuf_size)
+            chunk = self.__trans.read(self.__rbuf_size)
+            parts.append(chunk)
+            have += len(chunk)
 
         # but make sure we do read reqlen bytes.
-        if len(retstring) < reqlen:
-            retstring += self.__trans.readAll(reqlen - len(retstring))
+        if have < reqlen:
+            parts.append(self.__trans.readAll(reqlen - have))
 
-        self.__rbuf = BytesIO(retstring)
+        # join once, BytesIO then shares the result without copying it
+        self.__rbuf = BytesIO(b''.join(parts))
+        self.__rbuf_read = self.__rbuf.read
         return self.__rbuf
 
 
 class TMemoryBuffer(TTransportBase, CReadableTransport):
     """Wraps a cBytesIO object as a TTransport.
 
-    NOTE: Unlike the C++ version of this class, you cannot write to it
-          then immediately read from it.  If you want to read from a
-          TMemoryBuffer, you must either pass a string to the constructor.
-    TODO(dreiss): Make this work like the C++ version.
+    Like the C++ version of this class, writes always append to the end of
+    the buffer and reads pick up where the last read left off, so you can
+    write to it and then read back what was written.
     """
 
     def __init__(self, value=None, offset=0):
@@ -217,6 +262,10 @@ class TMemoryBuffer(TTransportBase, CReadableTransport):
             self._buffer = BytesIO()
         if offset:
             self._buffer.seek(offset)
+        # While writing, the BytesIO sits at the end of the data and this
+        # holds the read position.  While reading it is None and the read
+        # position is the BytesIO's own, which fastbinary advances directly.
+        self._rpos = None
 
     def isOpen(self):
         return not self._buffer.closed
@@ -228,20 +277,38 @@ class TMemoryBuffer(TTransportBase, CReadableTransport):
         self._buffer.close()
 
     def read(self, sz):
+        if self._rpos is not None:
+            self._start_reading()
         return self._buffer.read(sz)
 
     def write(self, buf):
+        if self._rpos is None:
+            self._rpos = self._buffer.tell()
+            self._buffer.seek(0, 2)
         self._buffer.write(buf)
 
+    def _start_reading(self):
+        self._buffer.seek(self._rpos)
+        self._rpos = None
+
     def flush(self):
         pass
 
     def getvalue(self):
         return self._buffer.getvalue()
 
+    def getbuffer(self):
+        """Returns a memoryview of the whole buffer without copying it.
+
+        The buffer can't be written to while the view is alive.
+        """
+        return self._buffer.getbuffer()
+
     # Implement the CReadableTransport interface.
     @property
     def cstringio_buf(self):
+        if self._rpos is not None:
+            self._start_reading()
         return self._buffer
 
     def cstringio_refill(self, partialread, reqlen):
@@ -249,6 +316,100 @@ class TMemoryBuffer(TTransportBase, CReadableTransport):
         raise EOFError()
 
 
+class TMmapMemoryBuffer(TTransportBase, CReadableTransport):
+    """A memory buffer transport over a fixed-size writable buffer.
+
+    The buffer is typically an mmap.mmap of a file or the buf of a
+    multiprocessing.shared_memory.SharedMemory block, so a producer can
+    serialize straight into memory another process maps, without first
+    building a bytes object.  The caller owns the buffer; close() only
+    releases this transport's view of it.
+
+    Like TMemoryBuffer, writes append and reads continue from the last read.
+    The read and write positions are local to this object, so processes
+    sharing the memory have to exchange the written length themselves.
+    """
+
+    def __init__(self, buf, length=0):
+        """buf -- an mmap.mmap or any other writable buffer
+
+        length -- number of bytes at the start of buf that already hold
+        data to read"""
+        self._view = memoryview(buf).cast('B')
+        self._rpos = 0
+        self._wpos = length
+        # BytesIO handed to fastbinary, and where in the buffer it starts
+        self._cbuf = None
+        self._cbuf_start = 0
+
+    def isOpen(self):
+        return self._view is not None
+
+    def open(self):
+        pass
+
+    def close(self):
+        self._cbuf = None
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+
+    def read(self, sz):
+        if self._cbuf is not None:
+            self._sync_cbuf()
+        end = min(self._rpos + sz, self._wpos)
+        ret = self._view[self._rpos:end].tobytes()
+        self._rpos = end
+        return ret
+
+    def write(self, buf):
+        end = self._wpos + len(buf)
+        if end > len(self._view):
+            raise TTransportException(TTransportException.SIZE_LIMIT,
+                                      "TMmapMemoryBuffer is full")
+        self._view[self._wpos:end] = buf
+        self._wpos = end
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return self._view[:self._wpos].tobytes()
+
+    def getbuffer(self):
+        """Returns a memoryview of the written data without copying it."""
+        return self._view[:self._wpos]
+
+    def _sync_cbuf(self):
+        # pick up whatever fastbinary consumed from the BytesIO
+        self._rpos = self._cbuf_start + self._cbuf.tell()
+        self._cbuf = None
+
+    # Implement the CReadableTransport interface.
+    @property
+    def cstringio_buf(self):
+        if self._cbuf is not None:
+            self._sync_cbuf()
+        return self._copy_window(self._rpos, 0)
+
+    def cstringio_refill(self, partialread, reqlen):
+        # partialread is the tail of the current window, so start the next
+        # window where it begins instead of copying it in front
+        start = self._cbuf_start + self._cbuf.tell() - len(partialread)
+        if self._wpos - start < reqlen:
+            raise EOFError()
+        return self._copy_window(start, reqlen)
+
+    def _copy_window(self, start, reqlen):
+        # fastbinary only reads from a BytesIO over a bytes object, so the
+        # data has to be copied out of the buffer; copy a window at a time
+        # rather than everything that's left
+        end = min(start + max(reqlen, TBufferedTransport.DEFAULT_BUFFER), self._wpos)
+        self._cbuf = BytesIO(self._view[start:end])
+        self._cbuf_start = start
+        return self._cbuf
+
+
 class TFramedTransportFactory(object):
     """Factory transport that builds framed transports"""
 
@@ -260,10 +421,16 @@ class TFramedTransportFactory(object):
 class TFramedTransport(TTransportBase, CReadableTransport):
     """Class that wraps another transport and frames its I/O when writing."""
 
+    # placeholder for the frame size, filled in on flush
+    FRAME_HEADER_SLOT = b'\x00\x00\x00\x00'
+
     def __init__(self, trans,):
         self.__trans = trans
         self.__rbuf = BytesIO(b'')
+        # bound read of the current buffer, rebound whenever it is replaced
+        self.__rbuf_read = self.__rbuf.read
         self.__wbuf = BytesIO()
+        self.__wbuf.write(self.FRAME_HEADER_SLOT)
 
     def isOpen(self):
         return self.__trans.isOpen()
@@ -275,31 +442,38 @@ class TFramedTransport(TTransportBase, CReadableTransport):
         return self.__trans.close()
 
     def read(self, sz):
-        ret = self.__rbuf.read(sz)
-        if len(ret) != 0:
+        ret = self.__rbuf_read(sz)
+        if ret:
             return ret
 
         self.readFrame()
-        return self.__rbuf.read(sz)
+        return self.__rbuf_read(sz)
 
     def readFrame(self):
         buff = self.__trans.readAll(4)
-        sz, = unpack('!i', buff)
+        sz, = _I32.unpack(buff)
         self.__rbuf = BytesIO(self.__trans.readAll(sz))
+        self.__rbuf_read = self.__rbuf.read
 
     def write(self, buf):
         self.__wbuf.write(buf)
 
     def flush(self):
-        wout = self.__wbuf.getvalue()
-        wsz = len(wout)
+        wsz = self.__wbuf.tell() - 4
+        if wsz == 0:
+            # like the C++ version, don't send empty frames
+            self.__trans.flush()
+            return
+        # N.B.: The frame size goes into the slot reserved at the start of
+        # wbuf, so the whole frame is handed over in a single write. Socket
+        # writes in Python turn out to be REALLY expensive, and this avoids
+        # copying the payload just to prepend the header.
+        with self.__wbuf.getbuffer() as view:
+            _I32.pack_into(view, 0, wsz)
+        buf = self.__wbuf.getvalue()
         # reset wbuf before write/flush to preserve state on underlying failure
-        self.__wbuf = BytesIO()
-        # N.B.: Doing this string concatenation is WAY cheaper than making
-        # two separate calls to the underlying socket object. Socket writes in
-        # Python turn out to be REALLY expensive, but it seems to do a pretty
-        # good job of managing string buffer operations without excessive copies
-        buf = pack("!i", wsz) + wout
+        self.__wbuf.seek(4)
+        self.__wbuf.truncate()
         self.__trans.write(buf)
         self.__trans.flush()
 
@@ -312,10 +486,15 @@ class TFramedTransport(TTransportBase, CReadableTransport):
         # self.__rbuf will already be empty here because fastbinary doesn't
         # ask for a refill until the previous buffer is empty.  Therefore,
         # we can start reading new frames immediately.
-        while len(prefix) < reqlen:
+        parts = [prefix]
+        total = len(prefix)
+        while total < reqlen:
             self.readFrame()
-            prefix += self.__rbuf.getvalue()
-        self.__rbuf = BytesIO(prefix)
+            data = self.__rbuf.getvalue()
+            parts.append(data)
+            total += len(data)
+        self.__rbuf = BytesIO(b''.join(parts))
+        self.__rbuf_read = self.__rbuf.read
         return self.__rbuf
 
 
@@ -401,13 +580,13 @@ class TSaslClientTransport(TTransportBase, CReadableTransport):
         return self.transport.isOpen()
 
     def send_sasl_msg(self, status, body):
-        header = pack(">BI", status, len(body))
+        header = _SASL_HDR.pack(status, len(body))
         self.transport.write(header + body)
         self.transport.flush()
 
     def recv_sasl_msg(self):
         header = self.transport.readAll(5)
-        status, length = unpack(">BI", header)
+        status, length = _SASL_HDR.unpack(header)
         if length > 0:
             payload = self.transport.readAll(length)
         else:
@@ -420,9 +599,10 @@ class TSaslClientTransport(TTransportBase, CReadableTransport):
     def flush(self):
         data = self.__wbuf.getvalue()
         encoded = self.sasl.wrap(data)
-        self.transport.write(pack("!i", len(encoded)) + encoded)
+        self.transport.write(_I32.pack(len(encoded)) + encoded)
         self.transport.flush()
-        self.__wbuf = BytesIO()
+        self.__wbuf.seek(0)
+        self.__wbuf.truncate(0)
 
     def read(self, sz):
         ret = self.__rbuf.read(sz)
@@ -434,7 +614,7 @@ class TSaslClientTransport(TTransportBase, CReadableTransport):
 
     def _read_frame(self):
         header = self.transport.readAll(4)
-        length, = unpack('!i', header)
+        length, = _I32.unpack(header)
         encoded = self.transport.readAll(length)
         self.__rbuf = BytesIO(self.sasl.unwrap(encoded))
 
@@ -451,8 +631,12 @@ class TSaslClientTransport(TTransportBase, CReadableTransport):
         # self.__rbuf will already be empty here because fastbinary doesn't
         # ask for a refill until the previous buffer is empty.  Therefore,
         # we can start reading new frames immediately.
-        while len(prefix) < reqlen:
+        parts = [prefix]
+        total = len(prefix)
+        while total < reqlen:
             self._read_frame()
-            prefix += self.__rbuf.getvalue()
-        self.__rbuf = BytesIO(prefix)
+            data = self.__rbuf.getvalue()
+            parts.append(data)
+            total += len(data)
+        self.__rbuf = BytesIO(b''.join(parts))
         return self.__rbuf
@@ -17,11 +17,19 @@
 # under the License.
 #
 
+import array
+import asyncio
+import mmap
 import unittest
 import os
+import struct
+import sys
+import types
+from unittest import mock
 
 import _import_local_thrift  # noqa
 from thrift.transport import TTransport
+from thrift.transport.TAsyncio import TAsyncioStreamTransport
 
 
 class TestTFileObjectTransport(unittest.TestCase):
@@ -44,6 +52,27 @@ class TestTFileObjectTransport(unittest.TestCase):
         os.remove(datatxt_path)
 
 
+class TestTTransportBase(unittest.TestCase):
+
+    def test_readAll_chunked(self):
+        data = b'0123456789' * 1000
+
+        class ChunkedTransport(TTransport.TTransportBase):
+            def __init__(self, value):
+                self.value = value
+
+            def read(self, sz):
+                ret = self.value[:min(sz, 7)]
+                self.value = self.value[len(ret):]
+                return ret
+
+        trans = ChunkedTransport(data)
+        self.assertEqual(trans.readAll(0), b'')
+        self.assertEqual(trans.readAll(5), data[:5])
+        self.assertEqual(trans.readAll(len(data) - 5), data[5:])
+        self.assertRaises(EOFError, trans.readAll, 1)
+
+
 class TestMemoryBuffer(unittest.TestCase):
 
     def test_memorybuffer_write(self):
@@ -65,6 +94,273 @@ class TestMemoryBuffer(unittest.TestCase):
         self.assertEqual(value_r.decode('utf-8'), data)
         buffer_r.close()
 
+    def test_memorybuffer_write_then_read(self):
+        buffer = TTransport.TMemoryBuffer()
+        buffer.write(b'hello ')
+        buffer.write(b'world')
+        self.assertEqual(buffer.read(5), b'hello')
+        buffer.write(b'!')
+        self.assertEqual(buffer.read(100), b' world!')
+        self.assertEqual(buffer.read(1), b'')
+        self.assertEqual(buffer.getvalue(), b'hello world!')
+
+        buffer = TTransport.TMemoryBuffer(b'abc', 1)
+        buffer.write(b'def')
+        self.assertEqual(buffer.read(100), b'bcdef')
+        self.assertEqual(bytes(buffer.getbuffer()), b'abcdef')
+        buffer.close()
+
+    def test_memorybuffer_cbuf(self):
+        data = b'0123456789'
+
+        buffer_r = TTransport.TMemoryBuffer(data)
+        self.assertEqual(buffer_r.read(3), b'012')
+        view = buffer_r.cbuf
+        self.assertTrue(view.readonly)
+        self.assertEqual(view.tobytes(), b'3456789')
+        self.assertEqual(buffer_r.read(2), b'34')
+        buffer_r.close()
+
+
+class TestMmapMemoryBuffer(unittest.TestCase):
+
+    def test_mmapmemorybuffer(self):
+        mm = mmap.mmap(-1, 16)
+        buffer = TTransport.TMmapMemoryBuffer(mm)
+        buffer.write(b'hello ')
+        buffer.write(b'world')
+        self.assertEqual(buffer.read(5), b'hello')
+        self.assertEqual(buffer.read(100), b' world')
+        self.assertEqual(mm[:11], b'hello world')
+        self.assertEqual(buffer.getbuffer().tobytes(), b'hello world')
+        self.assertRaises(TTransport.TTransportException, buffer.write, b'x' * 6)
+        buffer.close()
+        self.assertFalse(buffer.isOpen())
+
+        reader = TTransport.TMmapMemoryBuffer(mm, 11)
+        self.assertEqual(reader.cstringio_buf.read(6), b'hello ')
+        self.assertEqual(reader.read(100), b'world')
+        reader.close()
+        mm.close()
+
+    def test_mmapmemorybuffer_refill(self):
+        window = TTransport.TBufferedTransport.DEFAULT_BUFFER
+        data = bytes(bytearray(range(256))) * (3 * window // 256)
+        reader = TTransport.TMmapMemoryBuffer(bytearray(data), len(data))
+        self.assertEqual(reader.read(10), data[:10])
+
+        buf = reader.cstringio_buf
+        self.assertEqual(buf.read(2 * window), data[10:10 + window])
+        buf = reader.cstringio_refill(data[window:10 + window], window)
+        self.assertEqual(buf.read(window), data[window:2 * window])
+        self.assertRaises(EOFError, reader.cstringio_refill, b'', len(data))
+        self.assertEqual(reader.read(5), data[2 * window:2 * window + 5])
+
+    def test_mmapmemorybuffer_cast(self):
+        reader = TTransport.TMmapMemoryBuffer(array.array('i', [1, 2]), 8)
+        self.assertEqual(reader.read(100), array.array('i', [1, 2]).tobytes())
+
+
+class TestTBufferedTransport(unittest.TestCase):
+
+    class RecordingTransport(TTransport.TMemoryBuffer):
+        def __init__(self, value=None, chunk=None):
+            TTransport.TMemoryBuffer.__init__(self, value)
+            self.chunk = chunk
+            self.reads = []
+            self.flushes = 0
+
+        def read(self, sz):
+            self.reads.append(sz)
+            if self.chunk is not None:
+                sz = min(sz, self.chunk)
+            return TTransport.TMemoryBuffer.read(self, sz)
+
+        def flush(self):
+            self.flushes += 1
+
+    def test_buffered_read_chunked(self):
+        data = bytes(bytearray(range(250))) * 4
+        trans = self.RecordingTransport(data, chunk=50)
+        buffered = TTransport.TBufferedTransport(trans, rbuf_size=64)
+        parts = [buffered.readAll(10) for _ in range(100)]
+        self.assertEqual(b''.join(parts), data)
+        # short reads from the wrapped transport are topped up by readAll
+        self.assertEqual(set(trans.reads), set([64]))
+        self.assertRaises(EOFError, buffered.readAll, 1)
+
+    def test_buffered_large_read_bypasses_buffer(self):
+        data = bytes(bytearray(range(200)))
+        trans = self.RecordingTransport(data)
+        buffered = TTransport.TBufferedTransport(trans, rbuf_size=64)
+        self.assertEqual(buffered.read(100), data[:100])
+        self.assertEqual(buffered.read(10), data[100:110])
+        self.assertEqual(trans.reads, [100, 64])
+        # whatever is still buffered is returned first
+        self.assertEqual(buffered.read(64), data[110:164])
+        self.assertEqual(buffered.read(64), data[164:])
+        self.assertEqual(trans.reads, [100, 64, 64])
+
+    def test_buffered_cstringio_refill(self):
+        data = bytes(bytearray(range(200)))
+        trans = self.RecordingTransport(data)
+        buffered = TTransport.TBufferedTransport(trans, rbuf_size=64)
+        self.assertEqual(buffered.read(50), data[:50])
+        # what fastbinary does: drain the buffer, then ask for more
+        self.assertEqual(buffered.cstringio_buf.read(100), data[50:64])
+        buf = buffered.cstringio_refill(data[60:64], 8)
+        self.assertIs(buf, buffered.cstringio_buf)
+        self.assertEqual(buf.read(8), data[60:68])
+        # python reads continue from the refilled buffer
+        self.assertEqual(buffered.read(4), data[68:72])
+        buf = buffered.cstringio_refill(buffered.read(100), 100)
+        self.assertEqual(buf.read(100), data[72:172])
+        self.assertEqual(buffered.read(100), data[172:])
+
+    def test_buffered_flush(self):
+        trans = self.RecordingTransport()
+        buffered = TTransport.TBufferedTransport(trans)
+        wbuf = buffered._TBufferedTransport__wbuf
+        buffered.write(b'hello ')
+        buffered.write(b'world')
+        buffered.flush()
+        buffered.write(b'!')
+        buffered.flush()
+        # the write buffer is rewound, not replaced
+        self.assertIs(buffered._TBufferedTransport__wbuf, wbuf)
+        self.assertEqual(wbuf.getvalue(), b'')
+        self.assertEqual(trans.getvalue(), b'hello world!')
+        self.assertEqual(trans.flushes, 2)
+
+
+class TestTFramedTransport(unittest.TestCase):
+
+    def test_framed_flush(self):
+        out = TTransport.TMemoryBuffer()
+        framed = TTransport.TFramedTransport(out)
+        framed.write(b'hello ')
+        framed.write(b'world')
+        framed.flush()
+        big = b'x' * 100000
+        framed.write(big)
+        framed.flush()
+        framed.write(b'!')
+        framed.flush()
+        # empty frames aren't sent
+        framed.flush()
+        self.assertEqual(out.getvalue(),
+                         b'\x00\x00\x00\x0bhello world' +
+                         struct.pack('!i', len(big)) + big +
+                         b'\x00\x00\x00\x01!')
+
+        framed = TTransport.TFramedTransport(TTransport.TMemoryBuffer(out.getvalue()))
+        self.assertEqual(framed.read(100), b'hello world')
+        self.assertEqual(framed.read(len(big)), big)
+        self.assertEqual(framed.read(1), b'!')
+
+    def test_framed_read_chunked(self):
+        payload = bytes(bytearray(range(256))) * 4096
+
+        class ChunkedTransport(TTransport.TMemoryBuffer):
+            def read(self, sz):
+                return TTransport.TMemoryBuffer.read(self, min(sz, 1000))
+
+        trans = ChunkedTransport(struct.pack('!i', len(payload)) + payload)
+        framed = TTransport.TFramedTransport(trans)
+        self.assertEqual(framed.read(len(payload)), payload)
+
+
+class TestTAsyncioStreamTransport(unittest.TestCase):
+
+    def test_frame_roundtrip(self):
+        async def echo(reader, writer):
+            trans = TAsyncioStreamTransport(reader=reader, writer=writer)
+            frame = await trans.readFrame()
+            trans.write(frame[::-1])
+            await trans.flush()
+            trans.close()
+
+        async def run():
+            server = await asyncio.start_server(echo, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            trans = await TAsyncioStreamTransport('127.0.0.1', port).open()
+            self.assertTrue(trans.isOpen())
+            trans.write(b'hello ')
+            trans.write(b'world')
+            await trans.flush()
+            frame = await trans.readFrame()
+            with self.assertRaises(TTransport.TTransportException) as cm:
+                await trans.readFrame()
+            trans.close()
+            self.assertFalse(trans.isOpen())
+            server.close()
+            await server.wait_closed()
+            return frame, cm.exception.type
+
+        loop = asyncio.new_event_loop()
+        try:
+            frame, error = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        self.assertEqual(frame, b'dlrow olleh')
+        self.assertEqual(error, TTransport.TTransportException.END_OF_FILE)
+
+    def test_negative_frame_size(self):
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(struct.pack('!i', -1))
+            trans = TAsyncioStreamTransport(reader=reader)
+            with self.assertRaises(TTransport.TTransportException) as cm:
+                await trans.readFrame()
+            return cm.exception.type
+
+        loop = asyncio.new_event_loop()
+        try:
+            error = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        self.assertEqual(error, TTransport.TTransportException.NEGATIVE_SIZE)
+
+
+class TestTSaslClientTransport(unittest.TestCase):
+
+    def _make_transport(self, trans):
+        class SASLClient(object):
+            def __init__(self, host, service, mechanism, **kwargs):
+                self.mechanism = mechanism
+
+            def wrap(self, data):
+                return data
+
+            def unwrap(self, data):
+                return data
+
+        client = types.ModuleType('puresasl.client')
+        client.SASLClient = SASLClient
+        modules = {'puresasl': types.ModuleType('puresasl'), 'puresasl.client': client}
+        with mock.patch.dict(sys.modules, modules):
+            return TTransport.TSaslClientTransport(trans, 'host', 'service', 'PLAIN')
+
+    def test_sasl_flush(self):
+        class ListTransport(TTransport.TTransportBase):
+            def __init__(self):
+                self.writes = []
+
+            def write(self, buf):
+                self.writes.append(buf)
+
+        trans = ListTransport()
+        sasl = self._make_transport(trans)
+        sasl.write(b'abc')
+        sasl.flush()
+        sasl.write(b'de')
+        sasl.flush()
+        self.assertEqual(trans.writes, [b'\x00\x00\x00\x03abc', b'\x00\x00\x00\x02de'])
+
+        sasl = self._make_transport(TTransport.TMemoryBuffer(b''.join(trans.writes)))
+        self.assertEqual(sasl.read(10), b'abc')
+        self.assertEqual(sasl.read(10), b'de')
+
 
 if __name__ == '__main__':
     unittest.main()